@@ -0,0 +1,30 @@
+# imports
+from dotenv import load_dotenv
+import os
+
+# environment setup(read once at import, so gunicorn --preload shares it with every worker)
+load_dotenv("C:/EnvironmentalVariables/.env")
+DATABASE_URI = os.environ.get("DATABASE_URL", "sqlite:///blog.db")
+
+# connection pool config(sqlite files don't use a sized pool, so the pool size options are only set for servers)
+ENGINE_OPTIONS = {
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+}
+if DATABASE_URI.startswith("sqlite"):
+    ENGINE_OPTIONS["connect_args"] = {"check_same_thread": False}
+else:
+    ENGINE_OPTIONS.update(pool_size=10, max_overflow=20, pool_timeout=30)
+
+
+# config block
+class Config:
+    SECRET_KEY = os.environ.get("SECRET_KEY")
+
+    SQLALCHEMY_DATABASE_URI = DATABASE_URI
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = ENGINE_OPTIONS
+
+    # the cache is per worker process, so other workers may serve a stale home page until it times out
+    CACHE_TYPE = "SimpleCache"
+    CACHE_DEFAULT_TIMEOUT = 300
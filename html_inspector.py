@@ -1,22 +1,83 @@
 # imports
-import bleach
+from bleach.sanitizer import Cleaner
+from datetime import datetime
+import threading
+import re
+
+# constants
+ALLOWED_TAGS = frozenset([
+    'a', 'abbr', 'acronym', 'address', 'b', 'br', 'div', 'dl', 'dt',
+    'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img',
+    'li', 'ol', 'p', 'pre', 'q', 's', 'small', 'strike',
+    'span', 'sub', 'sup', 'table', 'tbody', 'td', 'tfoot', 'th',
+    'thead', 'tr', 'tt', 'u', 'ul'
+])
+
+ALLOWED_ATTRIBUTES = {
+    'a': ['href', 'target', 'title'],
+    'img': ['src', 'alt', 'width', 'height'],
+}
+
+# move this date forward when the rules above change, `flask resanitize-posts` cleans older posts again
+SANITIZER_RULES_UPDATED = datetime(2026, 10, 14)
+
+# a cleaner keeps its html5lib parser and filters between calls, but isn't thread safe,
+# so every thread builds its own one once and reuses it
+_local = threading.local()
+
+# allowed tags that can be kept as they are when they have no attributes,
+# tags that need attributes or that html5lib restructures(tables, pre) always go through bleach
+_PLAIN_TAGS = ALLOWED_TAGS - {'a', 'img', 'br', 'hr', 'pre', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr'}
+_VOID_TAGS = frozenset(['br', 'hr'])
+
+# html5lib implicitly closes an open p, heading, li or dt when a block tag(or hr) opens inside it,
+# so that nesting always goes through bleach too
+_BLOCK_TAGS = frozenset(['p', 'div', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'dl', 'li', 'dt', 'address',
+                         'hr'])
+_CLOSED_BY_BLOCK_TAGS = frozenset(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'dt'])
+
+# one pass over the html: plain tags, the entities bleach keeps, or any other character bleach would change
+_TOKEN_RE = re.compile(r'<(/?)([a-z0-9]+)>|&(?:nbsp|amp|lt|gt|quot);|[<>&\r\x00-\x08\x0b\x0c\x0e-\x1f\x7f]')
 
 
 # function block
+def _get_cleaner():
+    cleaner = getattr(_local, "cleaner", None)
+    if cleaner is None:
+        cleaner = _local.cleaner = Cleaner(tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, strip=True)
+    return cleaner
+
+
+def _is_plain_html(html_code):
+    """Checks whether the html only consists of text and allowed tags without attributes that html5lib keeps as
+    they are(properly nested and without blocks inside a p, heading, li or dt)"""
+    open_tags = []
+    for match in _TOKEN_RE.finditer(html_code):
+        token = match.group(0)
+        if token[0] == '&' and len(token) > 1:
+            continue
+
+        tag = match.group(2)
+        if tag is None:
+            return False
+        if match.group(1):
+            if not open_tags or open_tags.pop() != tag:
+                return False
+            continue
+
+        if tag in _BLOCK_TAGS and any(open_tag in _CLOSED_BY_BLOCK_TAGS for open_tag in open_tags):
+            return False
+        if tag in _PLAIN_TAGS:
+            open_tags.append(tag)
+        elif tag not in _VOID_TAGS:
+            return False
+
+    return not open_tags
+
+
 def strip_invalid_html(html_code):
-    allowed_tags = ['a', 'abbr', 'acronym', 'address', 'b', 'br', 'div', 'dl', 'dt',
-                    'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img',
-                    'li', 'ol', 'p', 'pre', 'q', 's', 'small', 'strike',
-                    'span', 'sub', 'sup', 'table', 'tbody', 'td', 'tfoot', 'th',
-                    'thead', 'tr', 'tt', 'u', 'ul'
-                    ]
-
-    allowed_attributes = {
-        'a': ['href', 'target', 'title'],
-        'img': ['src', 'alt', 'width', 'height'],
-    }
-
-    # clean the html with bleach
-    cleaned_html = bleach.clean(html_code, tags=allowed_tags, attributes=allowed_attributes, strip=True)
-
-    return cleaned_html
+    # plain html is already clean, everything else is cleaned with bleach
+    if _is_plain_html(html_code):
+        return html_code
+
+    return _get_cleaner().clean(html_code)
@@ -1,28 +1,39 @@
 # imports
-from flask import Flask, render_template, redirect, url_for, flash, abort
+from flask import Flask, render_template, redirect, url_for, flash, abort, request, Response, stream_with_context
 from flask_bootstrap import Bootstrap
 from flask_ckeditor import CKEditor
-from datetime import date
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_caching import Cache
+from jinja2 import FileSystemBytecodeCache
+from datetime import date, datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, or_
+from sqlalchemy.engine import Engine
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import relationship
-from flask_login import UserMixin, login_user, LoginManager, login_required, current_user, logout_user
+from sqlalchemy.orm import relationship, load_only, selectinload
+from flask_login import UserMixin, login_user, LoginManager, current_user, logout_user
 from forms import CreatePostForm, RegisterForm, LoginForm, CommentForm
 from flask_gravatar import Gravatar
 from typing import Callable
-from functools import wraps
-from html_inspector import strip_invalid_html
-from dotenv import load_dotenv
-import os
+from functools import wraps, lru_cache
+from contextlib import contextmanager
+from html_inspector import strip_invalid_html, SANITIZER_RULES_UPDATED
+from password_manager import hash_password, verify_password, needs_rehash
+from config import Config
+import sqlite3
+import click
 
 # app setup
 app = Flask(__name__)
-load_dotenv("C:/EnvironmentalVariables/.env")
-app.config['SECRET_KEY'] = os.environ.get("SECRET_KEY")
+app.config.from_object(Config)
 ckeditor = CKEditor(app)
 Bootstrap(app)
 
+# compiled templates are cached on disk, so a new worker loads the bytecode instead of parsing the templates again
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+
+# cache setup
+cache = Cache(app)
+
 # LoginManager setup
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -50,14 +61,29 @@ class MySQLAlchemy(SQLAlchemy):
     Integer: Callable
     String: Callable
     Text: Callable
+    Date: Callable
+    DateTime: Callable
     ForeignKey: Callable
 
 
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URL", "sqlite:///blog.db")
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = MySQLAlchemy(app)
 
 
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    """Switches sqlite connections to WAL mode so readers don't block on writers"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+
+# number of posts shown on one page of the home page and of the newest comments shown under a post
+POSTS_PER_PAGE = 10
+COMMENTS_PER_POST = 100
+
+
 # tables config
 class BlogPost(db.Model):
     """
@@ -67,12 +93,13 @@ class BlogPost(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(250), unique=True, nullable=False)
     subtitle = db.Column(db.String(250), nullable=False)
-    date = db.Column(db.String(250), nullable=False)
-    body = db.Column(db.Text, nullable=False)
+    date = db.Column(db.Date, nullable=False, index=True)
+    body_html = db.Column(db.Text, nullable=False)
+    body_sanitized_at = db.Column(db.DateTime)
     img_url = db.Column(db.String(250), nullable=False)
 
     # creating a relationship(child) with User
-    author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    author_id = db.Column(db.Integer, db.ForeignKey("users.id"), index=True)
     author = relationship("User", back_populates="posts")
 
     # creating a relationship with Comment
@@ -83,9 +110,14 @@ class BlogPost(db.Model):
         self.subtitle = subtitle
         self.author = author
         self.date = date
-        self.body = body
+        self.set_body(body)
         self.img_url = img_url
 
+    def set_body(self, body):
+        """Sanitizes the body once when it is saved, so reading the post never has to"""
+        self.body_html = strip_invalid_html(body)
+        self.body_sanitized_at = datetime.utcnow()
+
 
 class User(db.Model, UserMixin):
     """
@@ -101,11 +133,18 @@ class User(db.Model, UserMixin):
     posts = relationship("BlogPost", back_populates="author")
     comments = relationship("Comment", back_populates="author")
 
+    # ids of the users that can add, edit and delete posts
+    ADMIN_IDS = frozenset({1})
+
     def __init__(self, email, password, name):
         self.email = email
         self.password = password
         self.name = name
 
+    @property
+    def is_admin(self):
+        return self.id in self.ADMIN_IDS
+
 
 class Comment(db.Model, UserMixin):
     """
@@ -116,11 +155,11 @@ class Comment(db.Model, UserMixin):
     text = db.Column(db.String(150), nullable=False)
 
     # establishing a relationship with user database
-    author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    author_id = db.Column(db.Integer, db.ForeignKey("users.id"), index=True)
     author = relationship("User", back_populates="comments")
 
     # establishing a relationship with blogpost database
-    post_id = db.Column(db.Integer, db.ForeignKey("blog_posts.id"))
+    post_id = db.Column(db.Integer, db.ForeignKey("blog_posts.id"), index=True)
     parent_post = relationship("BlogPost", back_populates="comments")
 
     def __init__(self, text, author, parent_post):
@@ -132,29 +171,107 @@ class Comment(db.Model, UserMixin):
 # code for creating the database
 # db.create_all()
 # db.session.commit()
+# databases created before a schema change are updated with `python migrations.py`
+
+
+# database helpers
+@contextmanager
+def transaction():
+    """Commits everything done inside the block in one transaction or rolls all of it back on an error"""
+    try:
+        yield db.session
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+# template filters
+@app.template_filter("long_date")
+def format_long_date(value):
+    """Formats a date like 'December 10, 2021'"""
+    return value.strftime("%B %d, %Y")
+
+
+@app.template_filter("gravatar_url")
+@lru_cache(maxsize=1024)
+def gravatar_url(email):
+    """Builds the gravatar link of the email once, repeated commenters come from the cache"""
+    return gravatar(email)
+
+
+def stream_template(template_name, **context):
+    """Renders the template in chunks, so the page is sent while it is rendered instead of being built in memory"""
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(5)
+    return stream
+
+
+def preload_templates():
+    """Loads every template once at startup, so the first requests don't have to compile them"""
+    for template_name in app.jinja_env.list_templates(extensions=["html"]):
+        app.jinja_env.get_template(template_name)
+
+
+preload_templates()
+
 
 # decorator block
-def admin_only(current_user_in_decorator):
-    """Makes the page only accessible by the admin"""
+def admin_only(function):
+    """Makes the page only accessible by the admin(anonymous users are handled like login_required does)"""
+
+    @wraps(function)
+    def decorated_function(*args, **kwargs):
+        if current_user.is_anonymous:
+            return login_manager.unauthorized()
+        if not current_user.is_admin:
+            abort(403)
+        return function(*args, **kwargs)
 
-    def decorator(function):
-        @wraps(function)
-        def decorated_function(*args, **kwargs):
-            if current_user_in_decorator.is_authenticated and current_user_in_decorator.id == 1:
-                return function(*args, **kwargs)
-            else:
-                abort(403)
+    return decorated_function
 
-        return decorated_function
 
-    return decorator
+# pages that don't read from the database(the navbar still depends on the user)
+STATIC_PAGES = frozenset(["about", "contact", "easter_egg"])
 
 
-# home page setup
+@app.after_request
+def add_cache_headers(response):
+    """Lets browsers and proxies reuse the static pages and answer repeated requests with 304 Not Modified"""
+    if request.endpoint in STATIC_PAGES and response.status_code == 200:
+        # logged in users get their own navbar, so only the anonymous page can be shared
+        if current_user.is_authenticated:
+            response.cache_control.private = True
+        else:
+            response.cache_control.public = True
+        response.cache_control.max_age = 3600
+        response.vary.add("Cookie")
+        response.add_etag()
+        response.make_conditional(request)
+    return response
+
+
+# home page setup(logged in users see their own controls, so only the anonymous page is cached)
 @app.route('/')
+@cache.cached(query_string=True, unless=lambda: current_user.is_authenticated)
 def get_all_posts():
-    posts = BlogPost.query.all()
-    return render_template("index.html", all_posts=posts, user=current_user)
+    page = max(request.args.get("page", 1, type=int), 1)
+
+    # load only the columns the index needs(the body is left in the database)
+    # and fetch one extra post to know whether there is a next page
+    posts = BlogPost.query.options(
+        load_only(BlogPost.id, BlogPost.title, BlogPost.subtitle, BlogPost.date, BlogPost.img_url,
+                  BlogPost.author_id),
+        selectinload(BlogPost.author),
+    ).order_by(
+        BlogPost.date.desc(), BlogPost.id.desc()
+    ).limit(POSTS_PER_PAGE + 1).offset((page - 1) * POSTS_PER_PAGE).all()
+    has_next = len(posts) > POSTS_PER_PAGE
+
+    return render_template("index.html", all_posts=posts[:POSTS_PER_PAGE], user=current_user, page=page,
+                           has_next=has_next)
 
 
 # register page setup
@@ -167,14 +284,13 @@ def register():
     if form.validate_on_submit():
         # add new user to the database
         try:
-            new_user = User(
-                email=form.email.data,
-                password=generate_password_hash(password=form.password.data, method="pbkdf2:sha3_512:10000",
-                                                salt_length=21),
-                name=form.name.data,
-            )
-            db.session.add(new_user)
-            db.session.commit()
+            with transaction() as session:
+                new_user = User(
+                    email=form.email.data,
+                    password=hash_password(form.password.data),
+                    name=form.name.data,
+                )
+                session.add(new_user)
         except IntegrityError:
             flash("User already exists. Please Log In.")
             return redirect(url_for("login"))
@@ -197,17 +313,22 @@ def login():
 
     # check to see if the form was submitted
     if form.validate_on_submit():
-        # get the user from the database
-        user = User.query.filter_by(email=form.email.data).first()
+        # get the user from the database(only what's needed to check the password and log in)
+        user = User.query.options(load_only(User.id, User.password)).filter_by(email=form.email.data).first()
 
         # check to see if the user exists
         if not user:
             flash("Invalid email. Please try again.")
             return redirect(url_for("login"))
-        elif not check_password_hash(pwhash=user.password, password=form.password.data):  # check password
+        elif not verify_password(pwhash=user.password, password=form.password.data):  # check password
             flash("Invalid password. Please try again.")
             return redirect(url_for("login"))
 
+        # move hashes made with an older method to the current one while the password is known
+        if needs_rehash(user.password):
+            with transaction():
+                user.password = hash_password(form.password.data)
+
         # login user
         login_user(user, remember=True)
 
@@ -231,9 +352,8 @@ def logout():
 # blog page setup
 @app.route("/post/<int:post_id>", methods=["GET", "POST"])
 def show_post(post_id):
-    # get the requested post and all the comments, create a wtf form object
-    requested_post = BlogPost.query.get(post_id)
-    comments = Comment.query.all()
+    # get the requested post, create a wtf form object
+    requested_post = BlogPost.query.get_or_404(post_id)
     form = CommentForm()
 
     # check to see whether the form was submitted
@@ -244,46 +364,58 @@ def show_post(post_id):
             return redirect(url_for("login"))
 
         # add new comment to the database
-        new_comment = Comment(text=strip_invalid_html(form.comment_editor.data),
-                              author=current_user,
-                              parent_post=requested_post,
-                              )
-        db.session.add(new_comment)
-        db.session.commit()
+        with transaction() as session:
+            new_comment = Comment(text=strip_invalid_html(form.comment_editor.data),
+                                  author=current_user,
+                                  parent_post=requested_post,
+                                  )
+            session.add(new_comment)
 
     # clear the comment editor
     form.comment_editor.data = ""
 
-    # render html template
-    return render_template("post.html", post=requested_post, user=current_user, form=form, comments=comments)
+    # get the newest comments of the post(with their authors), the total is only counted when some didn't fit
+    comments = Comment.query.filter_by(post_id=post_id).options(
+        selectinload(Comment.author)
+    ).order_by(Comment.id.desc()).limit(COMMENTS_PER_POST).all()
+    if len(comments) < COMMENTS_PER_POST:
+        comment_count = len(comments)
+    else:
+        comment_count = Comment.query.filter_by(post_id=post_id).count()
+
+    # load the user before streaming, the session can't be changed once the headers are sent
+    user = current_user._get_current_object()
+
+    # stream html template
+    return Response(stream_with_context(stream_template("post.html", post=requested_post, user=user, form=form,
+                                                        comments=comments, comment_count=comment_count)))
 
 
 # about page setup
 @app.route("/about")
+@cache.cached(unless=lambda: current_user.is_authenticated)
 def about():
     return render_template("about.html")
 
 
 # page for editing posts
 @app.route("/edit-post/<int:post_id>", methods=["GET", "POST"])
-@login_required
-@admin_only(current_user)
+@admin_only
 def edit_post(post_id):
-    post = BlogPost.query.get(post_id)
+    post = BlogPost.query.get_or_404(post_id)
     edit_form = CreatePostForm(
         title=post.title,
         subtitle=post.subtitle,
         img_url=post.img_url,
-        author=post.author,
-        body=post.body
+        body=post.body_html
     )
     if edit_form.validate_on_submit():
-        post.title = edit_form.title.data
-        post.subtitle = edit_form.subtitle.data
-        post.img_url = edit_form.img_url.data
-        post.author = edit_form.author.data
-        post.body = strip_invalid_html(edit_form.body.data)
-        db.session.commit()
+        with transaction():
+            post.title = edit_form.title.data
+            post.subtitle = edit_form.subtitle.data
+            post.img_url = edit_form.img_url.data
+            post.set_body(edit_form.body.data)
+        cache.clear()
         return redirect(url_for("show_post", post_id=post.id))
 
     return render_template("make-post.html", form=edit_form)
@@ -291,48 +423,62 @@ def edit_post(post_id):
 
 # contact page setup
 @app.route("/contact")
+@cache.cached(unless=lambda: current_user.is_authenticated)
 def contact():
     return render_template("contact.html")
 
 
 # page for adding new posts
 @app.route("/new-post", methods=["GET", "POST"])
-@login_required
-@admin_only(current_user)
+@admin_only
 def add_new_post():
     form = CreatePostForm()
     if form.validate_on_submit():
-        new_post = BlogPost(
-            title=form.title.data,
-            subtitle=form.subtitle.data,
-            body=strip_invalid_html(form.body.data),
-            img_url=form.img_url.data,
-            author=current_user,
-            date=date.today().strftime("%B %d, %Y")
-        )
-        db.session.add(new_post)
-        db.session.commit()
+        with transaction() as session:
+            new_post = BlogPost(
+                title=form.title.data,
+                subtitle=form.subtitle.data,
+                body=form.body.data,
+                img_url=form.img_url.data,
+                author=current_user,
+                date=date.today()
+            )
+            session.add(new_post)
+        cache.clear()
         return redirect(url_for("get_all_posts"))
     return render_template("make-post.html", form=form)
 
 
 # delete page setup
 @app.route("/delete/<int:post_id>")
-@login_required
-@admin_only(current_user)
+@admin_only
 def delete_post(post_id):
-    post_to_delete = BlogPost.query.get(post_id)
-    db.session.delete(post_to_delete)
-    db.session.commit()
+    post_to_delete = BlogPost.query.get_or_404(post_id)
+    with transaction() as session:
+        session.delete(post_to_delete)
+    cache.clear()
     return redirect(url_for('get_all_posts'))
 
 
 # easter egg
 @app.route("/love-you")
+@cache.cached(unless=lambda: current_user.is_authenticated)
 def easter_egg():
     return render_template("danya.html")
 
 
+# cli commands
+@app.cli.command("resanitize-posts")
+def resanitize_posts():
+    """Sanitizes the posts again that were saved before the current sanitizer rules"""
+    stale_posts = BlogPost.query.filter(or_(BlogPost.body_sanitized_at.is_(None),
+                                            BlogPost.body_sanitized_at < SANITIZER_RULES_UPDATED)).all()
+    with transaction():
+        for post in stale_posts:
+            post.set_body(post.body_html)
+    click.echo(f"Sanitized {len(stale_posts)} posts.")
+
+
 # run config
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,68 @@
+# imports
+from sqlalchemy import inspect, text
+from datetime import datetime, date
+from main import db
+
+
+# migration block
+def add_foreign_key_indexes(connection):
+    """Adds the indexes on the foreign key columns to databases created before they were declared"""
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_blog_posts_author_id ON blog_posts (author_id)")
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_comments_author_id ON comments (author_id)")
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_comments_post_id ON comments (post_id)")
+
+
+def convert_post_dates(connection):
+    """Turns the 'December 10, 2021' strings in blog_posts.date into real dates"""
+    if connection.dialect.name == "sqlite":
+        # sqlite keeps the column type, SQLAlchemy reads dates stored as ISO strings
+        for post_id, post_date in connection.execute("SELECT id, date FROM blog_posts").fetchall():
+            try:
+                converted_date = datetime.strptime(post_date, "%B %d, %Y").date()
+            except ValueError:
+                # already converted rows are skipped, anything else would break reading the post
+                try:
+                    date.fromisoformat(post_date)
+                except ValueError:
+                    raise ValueError(f"Post {post_id} has a date that can't be converted: {post_date!r}") from None
+                continue
+            connection.execute(text("UPDATE blog_posts SET date = :date WHERE id = :id"),
+                               date=converted_date.isoformat(), id=post_id)
+    else:
+        date_column = next(column for column in inspect(connection).get_columns("blog_posts")
+                           if column["name"] == "date")
+        if str(date_column["type"]) != "DATE":
+            connection.execute("ALTER TABLE blog_posts ALTER COLUMN date TYPE DATE "
+                               "USING to_date(date, 'FMMonth DD, YYYY')")
+
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_blog_posts_date ON blog_posts (date)")
+
+
+def materialize_post_body(connection):
+    """Renames blog_posts.body to body_html and adds the time it was sanitized at"""
+    column_names = [column["name"] for column in inspect(connection).get_columns("blog_posts")]
+    if "body" in column_names:
+        connection.execute("ALTER TABLE blog_posts RENAME COLUMN body TO body_html")
+
+    # the existing posts are left without a time, so `flask resanitize-posts` cleans them with the current rules
+    if "body_sanitized_at" not in column_names:
+        connection.execute("ALTER TABLE blog_posts ADD COLUMN body_sanitized_at TIMESTAMP")
+
+
+# every migration has to be safe to run again on an already migrated database
+MIGRATIONS = [
+    add_foreign_key_indexes,
+    convert_post_dates,
+    materialize_post_body,
+]
+
+
+def run_migrations():
+    with db.engine.begin() as connection:
+        for migration in MIGRATIONS:
+            migration(connection)
+
+
+# run config
+if __name__ == "__main__":
+    run_migrations()
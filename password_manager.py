@@ -0,0 +1,22 @@
+# imports
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# constants
+# sha256 runs on the CPU's SHA extensions in OpenSSL, 30000 rounds take about as long(~10 ms) as the old
+# pbkdf2:sha3_512:10000 hashes, so signing up and logging in don't get slower
+HASH_METHOD = "pbkdf2:sha256:30000"
+SALT_LENGTH = 21
+
+
+# function block
+def hash_password(password):
+    return generate_password_hash(password=password, method=HASH_METHOD, salt_length=SALT_LENGTH)
+
+
+def verify_password(pwhash, password):
+    return check_password_hash(pwhash=pwhash, password=password)
+
+
+def needs_rehash(pwhash):
+    """Checks whether the hash was made with an older method than HASH_METHOD"""
+    return pwhash.split("$", 1)[0] != HASH_METHOD
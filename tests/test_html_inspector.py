@@ -0,0 +1,56 @@
+# imports
+from bleach.sanitizer import Cleaner
+import random
+import pytest
+from html_inspector import strip_invalid_html, ALLOWED_TAGS, ALLOWED_ATTRIBUTES, _PLAIN_TAGS, _is_plain_html
+
+# the reference every result is compared with: a plain bleach cleaner with the same rules
+cleaner = Cleaner(tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, strip=True)
+
+NESTED_CASES = [
+    '<p>x</p>', '<p>a <b>b</b><br>c</p>', '<div><p>x</p></div>', '<ul><li>a</li><li>b</li></ul>',
+    '<p><div>x</div></p>', '<h1><h2>x</h2></h1>', '<p><ul><li>a</li></ul></p>', '<li><li>x</li></li>',
+    '<dt><dt>x</dt></dt>', '<p><p>x</p></p>', '<li><p>x</p></li>', '<h1><address>x</address></h1>',
+    '<p><hr></p>', '<p>a</p><hr>',
+]
+
+UNSAFE_CASES = [
+    '<script>alert(1)</script><p>a</p>', '<p onclick="x()">a</p>', '<a href="javascript:x()">l</a>',
+    '<img src="a.png" onerror="x()">', '<form><input></form>', '<svg><script>x</script></svg>',
+    '<p style="color: red">a</p>', 'a & b < c', '<P>upper</P>', '<p>unclosed',
+]
+
+TEXT_FRAGMENTS = ['x', 'y z', ' ', '&nbsp;', '&amp;', '<br>', '<hr>', '\n']
+
+
+# test block
+@pytest.mark.parametrize("html_code", NESTED_CASES + UNSAFE_CASES)
+def test_matches_bleach(html_code):
+    assert strip_invalid_html(html_code) == cleaner.clean(html_code)
+
+
+def random_tree(rng, depth=0):
+    """Builds random html out of text and nested plain tags"""
+    parts = []
+    for _ in range(rng.randint(0, 3)):
+        if depth > 3 or rng.random() < 0.3:
+            parts.append(rng.choice(TEXT_FRAGMENTS))
+        else:
+            tag = rng.choice(sorted(_PLAIN_TAGS))
+            parts.append(f"<{tag}>{random_tree(rng, depth + 1)}</{tag}>")
+    return "".join(parts)
+
+
+def test_generated_fragments_match_bleach():
+    rng = random.Random(0)
+    accepted = 0
+    mismatches = []
+    for _ in range(20000):
+        html_code = random_tree(rng)
+        accepted += _is_plain_html(html_code)
+        if strip_invalid_html(html_code) != cleaner.clean(html_code):
+            mismatches.append(html_code)
+
+    # the comparison only means something when a good part of the fragments took the fast path
+    assert accepted > 5000
+    assert mismatches == []